@@ -3,13 +3,39 @@ IDOT Bid Letting Scraper - Serverless Function (Vercel-compatible version)
 This version uses Vercel's native request/response format instead of BaseHTTPRequestHandler
 """
 
+import os
+import re
 import json
-import urllib.request
-import urllib.error
-from urllib.parse import urljoin
+import uuid
+import queue
+import base64
+import random
+import asyncio
+import time
+import hashlib
+import sqlite3
+import itertools
+import tempfile
+import ssl
+import zlib
+import codecs
+import threading
+import contextvars
+import http.client
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qs, parse_qsl, urlencode
 import csv
+from collections import OrderedDict
 from io import StringIO
 from html.parser import HTMLParser
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# Brotli is optional: install it to let IDOT send 'br' encoded pages.
+# Without it we still negotiate gzip and deflate from the standard library.
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Counties we care about (Chicago metro area)
 VALID_COUNTIES = {
@@ -20,22 +46,145 @@ VALID_COUNTIES = {
 # Contract statuses we want to include
 VALID_STATUSES = {'active', 'executed', 'awarded'}
 
+# Columns of the CSV output
+CSV_FIELDS = ['contract_url', 'low_bidder', 'low_bid_amount', 'awardee']
+
+# Maximum number of contract detail pages fetched at the same time per scrape
+MAX_CONCURRENT_FETCHES = 8
+
+# Threads shared by every scrape in this process for blocking network I/O.
+# Concurrent scrapes on a warm instance share these instead of each
+# starting its own pool.
+MAX_FETCH_THREADS = 32
+
+# Seconds to wait on the IDOT servers before giving up on a request
+REQUEST_TIMEOUT = 30
+
+# Idle keep-alive connections kept open per host between requests
+MAX_IDLE_CONNECTIONS_PER_HOST = MAX_FETCH_THREADS
+
+# Politeness limits towards each host, shared by every fetch in the
+# process: a token bucket of REQUESTS_PER_SECOND (bursting up to
+# REQUEST_BURST) and at most MAX_CONNECTIONS_PER_HOST requests in flight.
+# Set REQUESTS_PER_SECOND to 0 to disable the rate limit.
+REQUESTS_PER_SECOND = 5
+REQUEST_BURST = 5
+MAX_CONNECTIONS_PER_HOST = 8
+
+# Transient failures (connection errors, timeouts, 429 and these 5xx
+# statuses) are retried with exponential backoff and full jitter
+MAX_RETRIES = 4
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 8
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# A server asking us (Retry-After) to wait longer than this is not retried
+RETRY_AFTER_MAX = 30
+
+# Seconds a whole scrape may take. No retry is started that would wait
+# past this point, so flaky servers cannot stall a run indefinitely.
+SCRAPE_TIME_BUDGET = 50
+
+# Assumed duration of a contract fetch until real ones have been timed.
+# A fetch is only started if it is expected to finish before the deadline.
+FETCH_TIME_ESTIMATE = 2.0
+
+# Background scrape jobs (POST with "job": true, then poll with GET).
+# Jobs live in this process's memory, so polling has to reach the same
+# instance: fine for local development or a single long-lived server.
+MAX_RUNNING_JOBS = 4
+JOB_TIME_BUDGET = 15 * 60
+JOB_RETENTION_SECONDS = 60 * 60
+MAX_STORED_JOBS = 100
+
+# Complete scrape results are kept in memory and served again to requests
+# for the same letting for RESULT_CACHE_SECONDS, unless the request asks
+# for a refresh. Least recently used results go first past the limits.
+RESULT_CACHE_SECONDS = 15 * 60
+RESULT_CACHE_MAX_ENTRIES = 50
+RESULT_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+# A streamed scrape only keeps the CSV of lettings up to this size for the
+# result cache, so each stream holds little more than a few rows
+STREAM_CACHE_MAX_BYTES = 256 * 1024
+
+# Continuation tokens describing more contracts than this, or decompressing
+# to more bytes than this, are rejected unread
+MAX_CONTINUATION_CONTRACTS = 100000
+MAX_CONTINUATION_TOKEN_BYTES = 64 * 1024
+
+# Redirects followed before a fetch is treated as failed
+MAX_REDIRECTS = 5
+
+# On-disk cache of fetched pages. /tmp is the only writable path on Vercel
+# and it survives between warm invocations of the same instance.
+CACHE_ENABLED = True
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'idot-scraper-cache')
+
+# Every scraped contract is also upserted into a SQLite database in /tmp,
+# so results outlive the run that produced them and can be queried
+STORE_ENABLED = True
+STORE_PATH = os.path.join(tempfile.gettempdir(), 'idot-scraper.sqlite3')
+# Most rows a GET query of the store returns
+STORE_QUERY_LIMIT = 1000
+
+# Cached pages younger than this are served without contacting IDOT
+CACHE_FRESH_SECONDS = 6 * 60 * 60
+
+# Entries are evicted (least recently used first) past these limits
+CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+# Eviction runs each time another 1/CACHE_EVICT_FRACTION of CACHE_MAX_BYTES
+# has been written, so the cache can briefly overshoot by that much
+CACHE_EVICT_FRACTION = 20
+
+# Bytes read from the socket per chunk when downloading a page
+READ_CHUNK_SIZE = 64 * 1024
+
+# Responses are compressed (brotli if installed, else gzip) when the client
+# accepts it and the body is at least COMPRESS_MIN_BYTES. Streamed bodies
+# are always compressed, flushing after every chunk.
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept-Encoding': 'gzip, deflate, br' if brotli else 'gzip, deflate',
+    'Connection': 'keep-alive'
+}
+
+
+class TableRow(list):
+    """
+    A table row: a list of cell strings plus the hrefs found in its cells.
+    link_cells[i] is the index of the cell that holds links[i].
+    """
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self.link_cells = []
+
 
 class SimpleHTMLParser(HTMLParser):
     """
     A minimal HTML parser that extracts tables and links from IDOT pages.
     This works without external dependencies like BeautifulSoup.
+    Cell text arrives in many small pieces (entities, inline tags, stream
+    chunks), so it is collected as a list of fragments and joined once at
+    the closing tag, keeping the parser linear in the size of the page.
+    Each row remembers the links in its own cells (TableRow.links).
     """
     def __init__(self):
         super().__init__()
         self.tables = []
         self.current_table = []
         self.current_row = []
-        self.current_cell = ''
+        self.cell_fragments = []
         self.in_table = False
         self.in_row = False
         self.in_cell = False
-        self.links = []
         
     def handle_starttag(self, tag, attrs):
         if tag == 'table':
@@ -43,14 +192,15 @@ class SimpleHTMLParser(HTMLParser):
             self.current_table = []
         elif tag == 'tr' and self.in_table:
             self.in_row = True
-            self.current_row = []
+            self.current_row = TableRow()
         elif tag in ['td', 'th'] and self.in_row:
             self.in_cell = True
-            self.current_cell = ''
+            self.cell_fragments = []
         elif tag == 'a' and self.in_cell:
             for attr_name, attr_value in attrs:
-                if attr_name == 'href':
-                    self.links.append(attr_value)
+                if attr_name == 'href' and attr_value:
+                    self.current_row.links.append(attr_value)
+                    self.current_row.link_cells.append(len(self.current_row))
     
     def handle_endtag(self, tag):
         if tag == 'table':
@@ -63,142 +213,1911 @@ class SimpleHTMLParser(HTMLParser):
                 self.current_table.append(self.current_row)
         elif tag in ['td', 'th'] and self.in_cell:
             self.in_cell = False
-            self.current_row.append(self.current_cell.strip())
+            self.current_row.append(''.join(self.cell_fragments).strip())
+            self.cell_fragments = []
     
     def handle_data(self, data):
         if self.in_cell:
-            self.current_cell += data
+            self.cell_fragments.append(data)
 
 
-def fetch_url(url):
-    """Fetch a URL and return its HTML content"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    }
-    req = urllib.request.Request(url, headers=headers)
+class FetchError(Exception):
+    """
+    Raised when a page cannot be fetched. status is set for HTTP errors,
+    retry_after (seconds) when the server sent a Retry-After header.
+    """
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the deadline leaves no time to retry a fetch or wait for one"""
+
+
+class PooledResponse:
+    """
+    Wraps an http.client response so that closing it hands the underlying
+    connection back to the pool. Connections are only reused when the body
+    was read to the end and the server did not ask to close it.
+    """
+    def __init__(self, pool, key, conn, response, on_close=None):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.on_close = on_close
+    
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+    
+    def read(self, amt=None):
+        return self.response.read(amt)
+    
+    def close(self):
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, conn)
+        else:
+            self.response.close()
+            conn.close()
+        if self.on_close:
+            self.on_close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Keeps idle keep-alive connections per host so repeated requests to the
+    IDOT servers pay for the TCP and TLS handshake only once. The pool lives
+    at module level, so warm invocations reuse it as well.
+    """
+    def __init__(self, max_idle_per_host=MAX_IDLE_CONNECTIONS_PER_HOST, timeout=REQUEST_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.ssl_context = ssl.create_default_context()
+        self.idle = {}
+        self.lock = threading.Lock()
+    
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+    
+    def acquire(self, key):
+        """Return an idle connection for key (or a new one) and whether it was reused"""
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop(), True
+        return self._connect(key), False
+    
+    def release(self, key, conn):
+        """Put a connection back into the pool, closing it if the pool is full"""
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(conn)
+                return
+        conn.close()
+    
+    def clear(self):
+        """Close every idle connection"""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+    
+    def request(self, url, headers, on_close=None):
+        """
+        Send a GET request for url and return a PooledResponse.
+        on_close is called once the response has been closed.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise FetchError(f"Unsupported URL scheme: {parts.scheme or url}")
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        
+        while True:
+            conn, reused = self.acquire(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server dropped an idle connection; retry once on a fresh one
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            return PooledResponse(self, key, conn, response, on_close)
+
+
+# Shared across every fetch in this process (and across warm invocations)
+HTTP_POOL = ConnectionPool()
+
+
+class HostLimiter:
+    """State for one host: its token bucket and its connection slots"""
+    def __init__(self, burst, max_connections):
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+
+class RateLimiter:
+    """
+    Keeps every request polite towards the IDOT servers: per host, a token
+    bucket limits the request rate and a semaphore limits how many requests
+    are in flight. All fetches in the process go through RATE_LIMITER.
+    """
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=REQUEST_BURST, max_connections=MAX_CONNECTIONS_PER_HOST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_connections = max_connections
+        self.hosts = {}
+        self.lock = threading.Lock()
     
+    def _host(self, host):
+        with self.lock:
+            limiter = self.hosts.get(host)
+            if limiter is None:
+                limiter = self.hosts[host] = HostLimiter(self.burst, self.max_connections)
+            return limiter
+    
+    def acquire(self, host):
+        """
+        Block until a request to host may start, and return a function
+        that must be called when the request is finished.
+        """
+        limiter = self._host(host)
+        limiter.slots.acquire()
+        if self.rate:
+            # Reserve a token; if the bucket is empty the balance goes
+            # negative and we sleep until our token would have been refilled
+            with self.lock:
+                now = time.monotonic()
+                limiter.tokens = min(self.burst, limiter.tokens + (now - limiter.updated) * self.rate)
+                limiter.updated = now
+                limiter.tokens -= 1
+                wait = -limiter.tokens / self.rate if limiter.tokens < 0 else 0
+            if wait:
+                time.sleep(wait)
+        return limiter.slots.release
+
+
+RATE_LIMITER = RateLimiter()
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) to seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
     try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            return response.read().decode('utf-8')
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def open_url_once(url, headers):
+    """Open url through the connection pool, following redirects"""
+    for _ in range(MAX_REDIRECTS + 1):
+        release = RATE_LIMITER.acquire(urlsplit(url).netloc.lower())
+        try:
+            response = HTTP_POOL.request(url, headers, on_close=release)
+        except BaseException:
+            release()
+            raise
+        if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+            location = response.getheader('Location')
+            response.read()
+            response.close()
+            url = urljoin(url, location)
+            continue
+        if response.status >= 400:
+            retry_after = parse_retry_after(response.getheader('Retry-After'))
+            response.read()
+            response.close()
+            raise FetchError(f"HTTP Error {response.status}: {response.reason}", response.status, retry_after)
+        return response
+    
+    raise FetchError(f"Too many redirects (more than {MAX_REDIRECTS})")
+
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retrying after error, or None if it is not transient"""
+    if isinstance(error, FetchError):
+        if error.status not in RETRY_STATUSES:
+            return None
+        if error.retry_after is not None:
+            if error.retry_after > RETRY_AFTER_MAX:
+                return None
+            return error.retry_after + random.uniform(0, RETRY_BACKOFF_BASE)
+    elif isinstance(error, ssl.SSLCertVerificationError):
+        return None
+    elif not isinstance(error, (OSError, http.client.HTTPException)):
+        return None
+    # Full jitter: anywhere between 0 and the exponential backoff ceiling
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+def open_url(url, headers=None, deadline=None):
+    """
+    Open url through the connection pool, following redirects and retrying
+    transient failures. If a retry's backoff would end after deadline (a
+    time.time() timestamp), DeadlineExceeded is raised instead.
+    """
+    request_headers = dict(REQUEST_HEADERS)
+    if headers:
+        request_headers.update(headers)
+    
+    attempt = 0
+    while True:
+        try:
+            return open_url_once(url, request_headers)
+        except Exception as e:
+            delay = retry_delay(e, attempt)
+            if delay is None or attempt >= MAX_RETRIES:
+                raise
+            if deadline is not None and time.time() + delay > deadline:
+                raise DeadlineExceeded(f"Time limit reached before retrying: {e}") from e
+            time.sleep(delay)
+            attempt += 1
+
+
+class ContentDecoder:
+    """Incrementally decodes a gzip, deflate or brotli encoded response body"""
+    def __init__(self, content_encoding):
+        self.encoding = (content_encoding or 'identity').strip().lower()
+        if self.encoding in ('gzip', 'x-gzip'):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        elif self.encoding == 'br' and brotli:
+            self.decompressor = brotli.Decompressor()
+        elif self.encoding == 'identity':
+            self.decompressor = None
+        else:
+            raise FetchError(f"Unsupported content encoding: {self.encoding}")
+        self.first_chunk = True
+    
+    def decompress(self, data, max_length=0):
+        """
+        Decode a chunk of the body. With max_length set, output beyond that
+        size is held back until the next call (pass b'' to drain it).
+        """
+        if self.decompressor is None:
+            return data
+        if self.encoding == 'br':
+            return self.decompressor.process(data)
+        if self.decompressor.unconsumed_tail:
+            data = self.decompressor.unconsumed_tail + data
+        try:
+            decoded = self.decompressor.decompress(data, max_length)
+        except zlib.error:
+            # Some servers send raw deflate without the zlib header
+            if self.encoding != 'deflate' or not self.first_chunk:
+                raise
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            decoded = self.decompressor.decompress(data, max_length)
+        self.first_chunk = False
+        return decoded
+    
+    def has_pending(self):
+        """True if decompress() held back output because of max_length"""
+        return bool(self.decompressor is not None and self.encoding != 'br' and self.decompressor.unconsumed_tail)
+    
+    def flush(self):
+        if self.decompressor is None or self.encoding == 'br':
+            return b''
+        return self.decompressor.flush()
+
+
+class TransferStats:
+    """Counts bytes received on the wire versus bytes after decompression"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.responses = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+    
+    def record(self, wire_bytes, decoded_bytes):
+        with self.lock:
+            self.responses += 1
+            self.wire_bytes += wire_bytes
+            self.decoded_bytes += decoded_bytes
+    
+    def snapshot(self):
+        with self.lock:
+            return {
+                'responses': self.responses,
+                'wire_bytes': self.wire_bytes,
+                'decoded_bytes': self.decoded_bytes,
+                'compression_ratio': round(self.decoded_bytes / self.wire_bytes, 2) if self.wire_bytes else None
+            }
+
+
+# The transfer snapshot of a result that cost no download (a cache hit)
+NO_TRANSFER = {'responses': 0, 'wire_bytes': 0, 'decoded_bytes': 0, 'compression_ratio': None}
+
+# The TransferStats of the scrape running in the current context, if any.
+# process_repository_async sets it and run_blocking carries it over to the
+# fetch threads, so each scrape counts only its own responses. A scrape that
+# joins another's in-flight fetch (REPOSITORY_FETCHES, CONTRACT_SCRAPES)
+# counts nothing for it: the bytes go to the scrape that started the fetch.
+CURRENT_TRANSFER_STATS = contextvars.ContextVar('current_transfer_stats', default=None)
+
+
+def iter_body(response):
+    """
+    Read a response in chunks and yield the decompressed bytes, never more
+    than READ_CHUNK_SIZE decoded bytes at a time for gzip and deflate.
+    """
+    decoder = ContentDecoder(response.getheader('Content-Encoding'))
+    stats = CURRENT_TRANSFER_STATS.get()
+    wire_bytes = 0
+    decoded_bytes = 0
+    try:
+        while True:
+            chunk = response.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            wire_bytes += len(chunk)
+            data = decoder.decompress(chunk, READ_CHUNK_SIZE)
+            while True:
+                if data:
+                    decoded_bytes += len(data)
+                    yield data
+                if not decoder.has_pending():
+                    break
+                data = decoder.decompress(b'', READ_CHUNK_SIZE)
+        data = decoder.flush()
+        if data:
+            decoded_bytes += len(data)
+            yield data
+    finally:
+        if stats:
+            stats.record(wire_bytes, decoded_bytes)
+
+
+class CacheWriter:
+    """
+    Writes a cache entry while the page is still being downloaded. The entry
+    only becomes visible on commit(), so an interrupted download never
+    leaves a truncated page behind.
+    """
+    def __init__(self, cache, url, meta):
+        self.cache = cache
+        self.url = url
+        self.file = None
+        self.size = 0
+        try:
+            os.makedirs(cache.directory, exist_ok=True)
+            fd, self.tmp_path = tempfile.mkstemp(dir=cache.directory, suffix='.tmp')
+            self.file = os.fdopen(fd, 'wb')
+            self.file.write(json.dumps(meta).encode('utf-8') + b'\n')
+        except OSError:
+            # A full or read-only /tmp must never break a scrape
+            self.abort()
+    
+    def write(self, data):
+        if self.file is None:
+            return
+        try:
+            self.file.write(data)
+            self.size += len(data)
+        except OSError:
+            self.abort()
+    
+    def commit(self):
+        if self.file is None:
+            return
+        try:
+            self.file.close()
+            self.file = None
+            os.replace(self.tmp_path, self.cache._path(self.url))
+        except OSError:
+            self.abort()
+            return
+        self.cache.stored(self.size)
+    
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if getattr(self, 'tmp_path', None):
+            self.cache._remove(self.tmp_path)
+
+
+class ResponseCache:
+    """
+    A small on-disk HTTP cache keyed by URL. Each entry is one file holding
+    a JSON metadata line (ETag, Last-Modified, store time) followed by the
+    page body. Fresh entries are served directly; stale ones are revalidated
+    with If-None-Match / If-Modified-Since. File modification times track
+    last use so eviction can drop the least recently used entries first.
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        # Eviction scans the whole directory, so it only runs after every
+        # evict_every bytes written rather than on each new entry
+        self.evict_every = max(1, max_bytes // CACHE_EVICT_FRACTION)
+        self.written = 0
+    
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest())
+    
+    def open_entry(self, url):
+        """
+        Return (metadata, file) for url, or None if it is not cached.
+        The file is positioned at the start of the body; the caller closes it.
+        """
+        try:
+            f = open(self._path(url), 'rb')
+        except OSError:
+            return None
+        try:
+            meta = json.loads(f.readline())
+        except ValueError:
+            f.close()
+            return None
+        if meta.get('url') != url or time.time() - meta['stored_at'] > self.max_age:
+            f.close()
+            return None
+        return meta, f
+    
+    def is_fresh(self, meta, max_age):
+        """True if the entry can be served without revalidation"""
+        if meta.get('server_max_age') is not None:
+            max_age = min(max_age, meta['server_max_age'])
+        return time.time() - meta['stored_at'] < max_age
+    
+    def has_fresh(self, url, max_age):
+        """True if url can currently be served from the cache without a request"""
+        entry = self.open_entry(url)
+        if entry is None:
+            return False
+        entry[1].close()
+        return self.is_fresh(entry[0], max_age)
+    
+    def touch(self, url):
+        """Mark an entry as recently used"""
+        try:
+            os.utime(self._path(url))
+        except OSError:
+            pass
+    
+    def writer(self, url, response):
+        """Return a CacheWriter for a 200 response, or None if it must not be stored"""
+        cache_control = (response.getheader('Cache-Control') or '').lower()
+        if 'no-store' in cache_control:
+            return None
+        max_age_match = re.search(r'max-age=(\d+)', cache_control)
+        meta = {
+            'url': url,
+            'etag': response.getheader('ETag'),
+            'last_modified': response.getheader('Last-Modified'),
+            'server_max_age': int(max_age_match.group(1)) if max_age_match else None,
+            'stored_at': time.time()
+        }
+        return CacheWriter(self, url, meta)
+    
+    def revalidated(self, url, meta, response):
+        """Record a 304 Not Modified answer by restamping the cached entry"""
+        meta = dict(meta, stored_at=time.time())
+        if response.getheader('ETag'):
+            meta['etag'] = response.getheader('ETag')
+        entry = self.open_entry(url)
+        if entry is None:
+            return
+        writer = CacheWriter(self, url, meta)
+        with entry[1] as cached:
+            for data in iter_file(cached):
+                writer.write(data)
+        writer.commit()
+    
+    def stored(self, size):
+        """Account for a committed entry of size bytes, evicting now and then"""
+        with self.lock:
+            self.written += size
+            if self.written < self.evict_every:
+                return
+            self.written = 0
+        self.evict()
+    
+    def evict(self):
+        """Drop expired entries, then the least recently used until under max_bytes"""
+        with self.lock:
+            entries = []
+            try:
+                names = os.listdir(self.directory)
+            except OSError:
+                return
+            now = time.time()
+            for name in names:
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    self._remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            
+            total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+    
+    def clear(self):
+        """Remove every cached entry"""
+        with self.lock:
+            try:
+                names = os.listdir(self.directory)
+            except OSError:
+                return
+            for name in names:
+                self._remove(os.path.join(self.directory, name))
+    
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+RESPONSE_CACHE = ResponseCache() if CACHE_ENABLED else None
+
+
+def iter_file(f):
+    """Yield a file's remaining content in READ_CHUNK_SIZE chunks"""
+    while True:
+        data = f.read(READ_CHUNK_SIZE)
+        if not data:
+            break
+        yield data
+
+
+def iter_page(url, max_age=CACHE_FRESH_SECONDS, deadline=None):
+    """
+    Yield the decompressed bytes of a page as they arrive.
+    Pages cached less than max_age seconds ago are read from disk without a
+    request; older ones are revalidated. Pass max_age=0 to always revalidate.
+    deadline bounds the retries (see open_url).
+    """
+    entry = RESPONSE_CACHE.open_entry(url) if RESPONSE_CACHE else None
+    meta, cached = entry if entry else (None, None)
+    try:
+        if meta and RESPONSE_CACHE.is_fresh(meta, max_age):
+            RESPONSE_CACHE.touch(url)
+            yield from iter_file(cached)
+            return
+        
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        
+        response = open_url(url, headers, deadline)
+        handed_off = False
+        try:
+            if response.status == 304 and meta:
+                response.read()
+                RESPONSE_CACHE.revalidated(url, meta, response)
+                yield from iter_file(cached)
+                return
+            
+            writer = None
+            if RESPONSE_CACHE and response.status == 200:
+                writer = RESPONSE_CACHE.writer(url, response)
+            body = iter_body(response)
+            try:
+                for data in body:
+                    if writer:
+                        writer.write(data)
+                    yield data
+            except GeneratorExit:
+                # The consumer stopped early. When caching, the rest of the
+                # page is read into the cache on FETCH_EXECUTOR, off the
+                # request path; otherwise the connection is just dropped.
+                if writer:
+                    FETCH_EXECUTOR.submit(drain_into_cache, response, body, writer)
+                    handed_off = True
+                raise
+            except BaseException:
+                if writer:
+                    writer.abort()
+                raise
+            if writer:
+                writer.commit()
+        finally:
+            if not handed_off:
+                response.close()
+    finally:
+        if cached:
+            cached.close()
+
+
+def drain_into_cache(response, body, writer):
+    """Read the rest of an abandoned download (body, from iter_body) into its cache entry"""
+    try:
+        for data in body:
+            writer.write(data)
+        writer.commit()
+    except Exception:
+        writer.abort()
+    finally:
+        response.close()
+
+
+def stream_url(url, max_age=CACHE_FRESH_SECONDS, deadline=None):
+    """Fetch a URL and yield its HTML content as text chunks while it downloads"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for data in iter_page(url, max_age, deadline):
+            text = decoder.decode(data)
+            if text:
+                yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        raise Exception(f"Failed to fetch {url}: {str(e)}")
+        raise FetchError(f"Failed to fetch {url}: {str(e)}", getattr(e, 'status', None))
 
 
-def parse_repository_page(html_content, base_url):
-    """Extract contract URLs from the repository page that match our filter criteria"""
-    parser = SimpleHTMLParser()
-    parser.feed(html_content)
+class SingleFlight:
+    """
+    Coalesces concurrent calls: while a call for a key is running, other
+    callers with the same key wait for it and get its result (or its
+    exception) instead of repeating the work. Nothing is kept afterwards.
+    """
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
     
-    # Find contract detail URLs that contain "LbContractDetail"
-    contract_urls = []
-    for link in parser.links:
+    def do(self, key, func, *args, deadline=None):
+        """Return func(*args), or the result of the same call already in flight (waiting until deadline)"""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            try:
+                return future.result(None if deadline is None else max(0, deadline - time.time()))
+            except FutureTimeout:
+                raise DeadlineExceeded("Time limit reached waiting for a concurrent request") from None
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return future.result()
+
+
+# Calls in flight, shared by every scrape in the process
+REPOSITORY_FETCHES = SingleFlight()
+CONTRACT_SCRAPES = SingleFlight()
+LETTING_SCRAPES = SingleFlight()
+
+
+def fetch_url(url, max_age=CACHE_FRESH_SECONDS, deadline=None):
+    """Fetch a URL and return its HTML content"""
+    return ''.join(stream_url(url, max_age, deadline))
+
+
+def feed_parser(parser, source, done=None):
+    """
+    Feed a parser from an HTML string or an iterable of HTML chunks.
+    If done is given it is called after every chunk; once it returns True
+    the rest of the input is skipped and the source is closed, which stops
+    the download when the source is a stream_url generator.
+    """
+    if isinstance(source, str):
+        parser.feed(source)
+    else:
+        for chunk in source:
+            parser.feed(chunk)
+            if done and done():
+                if hasattr(source, 'close'):
+                    source.close()
+                return parser
+    parser.close()
+    return parser
+
+
+def compile_terms(terms, whole_words=False):
+    """Compile a set of lowercase terms into one regex alternation, longest first"""
+    pattern = '|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    if whole_words:
+        pattern = r'\b(?:' + pattern + r')\b'
+    return re.compile(pattern)
+
+
+# Built once at import. One search per set runs entirely inside the regex
+# engine and stops at the first hit, instead of one substring scan per term.
+COUNTY_PATTERN = compile_terms(VALID_COUNTIES)
+STATUS_PATTERN = compile_terms(VALID_STATUSES)
+
+# Used when the County and Status columns are known. Whole words only, so
+# e.g. a Williamson County row is not taken for Will.
+COUNTY_CELL_PATTERN = compile_terms(VALID_COUNTIES, whole_words=True)
+STATUS_CELL_PATTERN = compile_terms(VALID_STATUSES, whole_words=True)
+
+
+def matches_filters(text):
+    """True if lowercased text mentions a valid county and a valid status"""
+    return COUNTY_PATTERN.search(text) is not None and STATUS_PATTERN.search(text) is not None
+
+
+def find_filter_columns(row):
+    """
+    If row is a header row with County and Status columns, return their
+    indexes (and the Contract column's, if present) as a dict. Otherwise None.
+    """
+    columns = {}
+    for index, cell in enumerate(row):
+        label = cell.lower()
+        for name in ('county', 'status', 'contract'):
+            if name not in columns and label.startswith(name):
+                columns[name] = index
+    if 'county' in columns and 'status' in columns:
+        return columns
+    return None
+
+
+def row_in_scope(row, columns):
+    """Apply the county and status filters to a repository row"""
+    if columns is None:
+        # No header found: fall back to matching anywhere in the row
+        return matches_filters(' '.join(row).lower())
+    county_col = columns['county']
+    status_col = columns['status']
+    if len(row) <= max(county_col, status_col):
+        return False
+    return (COUNTY_CELL_PATTERN.search(row[county_col].lower()) is not None
+            and STATUS_CELL_PATTERN.search(row[status_col].lower()) is not None)
+
+
+def row_contract_link(row, columns):
+    """
+    Return (link, cell index) for the row's contract detail link, preferring
+    the Contract column, or (None, None) if the row has none
+    """
+    contract_col = columns.get('contract') if columns else None
+    fallback = (None, None)
+    for link, cell_index in zip(row.links, row.link_cells):
         if 'LbContractDetail' in link:
-            full_url = urljoin(base_url, link)
-            if full_url not in contract_urls:
-                contract_urls.append(full_url)
+            if cell_index == contract_col:
+                return link, cell_index
+            if fallback[0] is None:
+                fallback = (link, cell_index)
+    return fallback
+
+
+def parse_repository_rows(html_content, base_url):
+    """
+    Return the repository page's contract rows that match our filter
+    criteria, in page order and one per contract URL, as dicts with
+    contract_url, contract_number, county, status and cells (the row's text).
+    html_content may be a string or an iterable of chunks (see stream_url).
+    """
+    parser = feed_parser(SimpleHTMLParser(), html_content)
     
-    # Filter based on county and status by checking the table content
-    filtered_urls = []
+    # Walk the rows once: each matching row contributes the contract link
+    # found in its own cells. A dict keeps the URLs ordered and unique.
+    filtered_rows = {}
     for table in parser.tables:
+        # The header row, if any, comes before the first contract row
+        columns = None
+        looking_for_header = True
         for row in table:
+            if looking_for_header:
+                columns = find_filter_columns(row)
+                if columns is not None:
+                    looking_for_header = False
+                    continue
+            
             if len(row) < 3:
                 continue
             
-            row_text = ' '.join(row).lower()
-            has_valid_county = any(county in row_text for county in VALID_COUNTIES)
-            has_valid_status = any(status in row_text for status in VALID_STATUSES)
+            contract_link, number_col = row_contract_link(row, columns)
+            if contract_link is None:
+                continue
+            looking_for_header = False
             
-            if has_valid_county and has_valid_status:
-                # This row matches - find corresponding URL
-                # We'll match URLs in order they appear
-                if contract_urls:
-                    url = contract_urls.pop(0)
-                    if url not in filtered_urls:
-                        filtered_urls.append(url)
+            if row_in_scope(row, columns):
+                contract_url = urljoin(base_url, contract_link)
+                if contract_url in filtered_rows:
+                    continue
+                filtered_rows[contract_url] = {
+                    'contract_url': contract_url,
+                    'contract_number': row[number_col] if number_col < len(row) else '',
+                    'county': row[columns['county']] if columns else '',
+                    'status': row[columns['status']] if columns else '',
+                    'cells': list(row)
+                }
     
-    return filtered_urls
+    return list(filtered_rows.values())
+
+
+def parse_repository_page(html_content, base_url):
+    """
+    Extract contract URLs from the repository page that match our filter criteria.
+    html_content may be a string or an iterable of chunks (see stream_url).
+    """
+    return [row['contract_url'] for row in parse_repository_rows(html_content, base_url)]
+
+
+def is_amount(cell):
+    """True if a cell holds nothing but a number or dollar amount"""
+    return cell.replace('.', '').replace(',', '').replace('$', '').replace(' ', '').isdigit()
+
+
+def extract_bidder_fields(table, fields):
+    """Update fields (low_bidder, low_bid_amount, awardee) from one detail page table"""
+    for i, row in enumerate(table):
+        row_text = ' '.join(row).lower()
+        
+        if 'low bid' in row_text or 'lowest bid' in row_text:
+            for cell in row:
+                if '$' in cell:
+                    fields['low_bid_amount'] = cell.strip()
+                elif len(cell) > 10 and not is_amount(cell):
+                    fields['low_bidder'] = cell.strip()
+            
+            if i + 1 < len(table):
+                next_row = table[i + 1]
+                for cell in next_row:
+                    if '$' in cell and not fields['low_bid_amount']:
+                        fields['low_bid_amount'] = cell.strip()
+                    elif len(cell) > 10 and not fields['low_bidder']:
+                        fields['low_bidder'] = cell.strip()
+        
+        if 'award' in row_text and 'awardee' in row_text:
+            for cell in row:
+                if len(cell) > 10 and not is_amount(cell):
+                    fields['awardee'] = cell.strip()
 
 
-def scrape_contract_detail(html_content):
-    """Extract bidder information from a contract detail page"""
+def scrape_contract_detail(html_content, early_exit=False):
+    """
+    Extract bidder information from a contract detail page.
+    html_content may be a string or an iterable of chunks (see stream_url).
+    With early_exit, parsing stops after the first complete table that
+    leaves all three fields filled in, and the rest of the page is skipped.
+    """
     parser = SimpleHTMLParser()
-    parser.feed(html_content)
+    fields = {'low_bidder': '', 'low_bid_amount': '', 'awardee': ''}
+    scanned = 0
     
-    low_bidder = ''
-    low_bid_amount = ''
-    awardee = ''
+    def all_found():
+        # Only completed tables are scanned: the low bid lookup reads the next row
+        nonlocal scanned
+        while scanned < len(parser.tables):
+            extract_bidder_fields(parser.tables[scanned], fields)
+            scanned += 1
+        return all(fields.values())
     
-    for table in parser.tables:
-        for i, row in enumerate(table):
-            row_text = ' '.join(row).lower()
-            
-            if 'low bid' in row_text or 'lowest bid' in row_text:
-                for cell in row:
-                    if '$' in cell:
-                        low_bid_amount = cell.strip()
-                    elif len(cell) > 10 and not cell.replace('.', '').replace(',', '').replace('$', '').replace(' ', '').isdigit():
-                        low_bidder = cell.strip()
-                
-                if i + 1 < len(table):
-                    next_row = table[i + 1]
-                    for cell in next_row:
-                        if '$' in cell and not low_bid_amount:
-                            low_bid_amount = cell.strip()
-                        elif len(cell) > 10 and not low_bidder:
-                            low_bidder = cell.strip()
-            
-            if 'award' in row_text and 'awardee' in row_text:
-                for cell in row:
-                    if len(cell) > 10 and not cell.replace('.', '').replace(',', '').replace('$', '').replace(' ', '').isdigit():
-                        awardee = cell.strip()
+    feed_parser(parser, html_content, all_found if early_exit else None)
+    all_found()
     
     return {
-        'low_bidder': low_bidder or 'Not Found',
-        'low_bid_amount': low_bid_amount or 'Not Found',
-        'awardee': awardee or 'Not Found'
+        'low_bidder': fields['low_bidder'] or 'Not Found',
+        'low_bid_amount': fields['low_bid_amount'] or 'Not Found',
+        'awardee': fields['awardee'] or 'Not Found'
     }
 
 
-def process_repository(repo_url):
-    """Main processing function that orchestrates the scraping workflow"""
-    results = []
+def scrape_contract(contract_url, deadline=None, max_age=CACHE_FRESH_SECONDS):
+    """
+    Fetch a single contract detail page and return its CSV row.
+    A cached copy of the page younger than max_age seconds is used as is
+    (see iter_page). Concurrent scrapes of the same contract share one fetch.
+    Failures give a row with an ERROR: low bidder, except DeadlineExceeded,
+    which is raised: the contract was not tried and is still to do.
+    """
+    try:
+        data = CONTRACT_SCRAPES.do(
+            (contract_url, max_age),
+            lambda: scrape_contract_detail(stream_url(contract_url, max_age, deadline), early_exit=True),
+            deadline=deadline
+        )
+        
+        return {
+            'contract_url': contract_url,
+            'low_bidder': data['low_bidder'],
+            'low_bid_amount': data['low_bid_amount'],
+            'awardee': data['awardee']
+        }
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        return {
+            'contract_url': contract_url,
+            'low_bidder': f'ERROR: {str(e)}',
+            'low_bid_amount': '',
+            'awardee': ''
+        }
+
+
+def normalize_repo_url(repo_url):
+    """Canonical form of a repository URL, so trivially different spellings share a cache entry"""
+    parts = urlsplit(repo_url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/') or '/', query, ''))
+
+
+def repository_row_fingerprint(repository_row):
+    """Hash of a repository row's text: it changes when the contract's listing does (status, dates, ...)"""
+    return hashlib.sha256(json.dumps(repository_row['cells']).encode('utf-8')).hexdigest()
+
+
+class ContractStore:
+    """
+    SQLite store of scraped contracts, one row per contract URL. The
+    repository listing (letting, contract number, county, status) and the
+    scraped bid fields are upserted separately as they become known. A hash
+    of the bid fields is kept so changed_at only moves when they change.
+    row_fingerprint identifies the contract's latest repository row and
+    scraped_fingerprint the row it had when its bid fields were scraped,
+    so a contract whose row is unchanged since needs no new fetch.
+    Failures to read or write the database never fail a scrape.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS contracts (
+            contract_url TEXT PRIMARY KEY,
+            contract_number TEXT,
+            letting_url TEXT,
+            county TEXT,
+            status TEXT,
+            low_bidder TEXT,
+            low_bid_amount TEXT,
+            awardee TEXT,
+            content_hash TEXT,
+            listed_at REAL,
+            fetched_at REAL,
+            changed_at REAL,
+            row_fingerprint TEXT,
+            scraped_fingerprint TEXT
+        );
+        CREATE INDEX IF NOT EXISTS contracts_letting ON contracts (letting_url);
+        CREATE INDEX IF NOT EXISTS contracts_number ON contracts (contract_number);
+        CREATE INDEX IF NOT EXISTS contracts_county ON contracts (county COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS contracts_bidder ON contracts (low_bidder COLLATE NOCASE);
+    """
+    # Columns added since the first version of the schema
+    ADDED_COLUMNS = {'row_fingerprint': 'TEXT', 'scraped_fingerprint': 'TEXT'}
     
-    # Fetch the repository page
-    html = fetch_url(repo_url)
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.db = None
+        self.lock = threading.Lock()
     
-    # Extract contract URLs
-    contract_urls = parse_repository_page(html, repo_url)
+    def _connect(self):
+        # Called with the lock held; shared by every thread in the process
+        if self.db is None:
+            db = sqlite3.connect(self.path, timeout=REQUEST_TIMEOUT, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.executescript(self.SCHEMA)
+            columns = {row['name'] for row in db.execute('PRAGMA table_info(contracts)')}
+            for name, column_type in self.ADDED_COLUMNS.items():
+                if name not in columns:
+                    db.execute(f'ALTER TABLE contracts ADD COLUMN {name} {column_type}')
+            self.db = db
+        return self.db
     
-    if not contract_urls:
+    def save_listing(self, letting_url, repository_rows):
+        """Upsert the repository rows (see parse_repository_rows) of a letting"""
+        now = time.time()
+        letting_url = normalize_repo_url(letting_url)
+        try:
+            with self.lock:
+                db = self._connect()
+                with db:
+                    db.executemany(
+                        """INSERT INTO contracts (contract_url, contract_number, letting_url, county, status, listed_at,
+                                                  row_fingerprint)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)
+                           ON CONFLICT (contract_url) DO UPDATE SET
+                               contract_number = excluded.contract_number, letting_url = excluded.letting_url,
+                               county = excluded.county, status = excluded.status, listed_at = excluded.listed_at,
+                               row_fingerprint = excluded.row_fingerprint""",
+                        [(row['contract_url'], row['contract_number'], letting_url, row['county'], row['status'], now,
+                          repository_row_fingerprint(row)) for row in repository_rows]
+                    )
+        except (sqlite3.Error, OSError):
+            pass
+    
+    def save_row(self, row):
+        """Upsert a scraped contract row (see scrape_contract); error rows are not stored"""
+        if row['low_bidder'].startswith('ERROR:'):
+            return
+        fields = [row['low_bidder'], row['low_bid_amount'], row['awardee']]
+        content_hash = hashlib.sha256(json.dumps(fields).encode('utf-8')).hexdigest()
+        now = time.time()
+        try:
+            with self.lock:
+                db = self._connect()
+                with db:
+                    db.execute(
+                        """INSERT INTO contracts (contract_url, low_bidder, low_bid_amount, awardee, content_hash,
+                                                  fetched_at, changed_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)
+                           ON CONFLICT (contract_url) DO UPDATE SET
+                               low_bidder = excluded.low_bidder, low_bid_amount = excluded.low_bid_amount,
+                               awardee = excluded.awardee, content_hash = excluded.content_hash,
+                               fetched_at = excluded.fetched_at, scraped_fingerprint = contracts.row_fingerprint,
+                               changed_at = CASE WHEN contracts.content_hash IS excluded.content_hash
+                                                 THEN contracts.changed_at ELSE excluded.changed_at END""",
+                        [row['contract_url'], *fields, content_hash, now, now]
+                    )
+        except (sqlite3.Error, OSError):
+            pass
+    
+    def unchanged_rows(self, repository_rows, fetched_since=None):
+        """
+        Return {contract_url: stored CSV row} for the repository rows (see
+        parse_repository_rows) whose contract was scraped while its row
+        looked exactly as it does now (and, if given, at or after the
+        fetched_since timestamp)
+        """
+        fingerprints = {row['contract_url']: repository_row_fingerprint(row) for row in repository_rows}
+        urls = list(fingerprints)
+        unchanged = {}
+        try:
+            with self.lock:
+                db = self._connect()
+                # Stay under SQLite's limit on query parameters
+                for start in range(0, len(urls), 500):
+                    batch = urls[start:start + 500]
+                    for row in db.execute(
+                        f"""SELECT contract_url, low_bidder, low_bid_amount, awardee, scraped_fingerprint
+                            FROM contracts
+                            WHERE contract_url IN ({', '.join('?' * len(batch))}) AND fetched_at >= ?""",
+                        [*batch, fetched_since or 0]
+                    ):
+                        if row['scraped_fingerprint'] == fingerprints[row['contract_url']]:
+                            unchanged[row['contract_url']] = {field: row[field] for field in CSV_FIELDS}
+        except (sqlite3.Error, OSError):
+            return {}
+        return unchanged
+    
+    def query(self, letting_url=None, county=None, bidder=None, limit=STORE_QUERY_LIMIT):
+        """Stored contracts matching every given filter (bidder matches low bidder or awardee)"""
+        conditions, args = ['fetched_at IS NOT NULL'], []
+        if letting_url:
+            conditions.append('letting_url = ?')
+            args.append(normalize_repo_url(letting_url))
+        if county:
+            conditions.append('county = ? COLLATE NOCASE')
+            args.append(county)
+        if bidder:
+            conditions.append('(low_bidder = ? COLLATE NOCASE OR awardee = ? COLLATE NOCASE)')
+            args.extend([bidder, bidder])
+        with self.lock:
+            db = self._connect()
+            rows = db.execute(
+                f"""SELECT contract_url, contract_number, letting_url, county, status, low_bidder, low_bid_amount,
+                           awardee, content_hash, fetched_at, changed_at
+                    FROM contracts WHERE {' AND '.join(conditions)}
+                    ORDER BY letting_url, contract_number LIMIT ?""",
+                [*args, limit]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+CONTRACT_STORE = ContractStore() if STORE_ENABLED else None
+
+
+# Runs the blocking fetch layer (connection pool, cache, streaming parse)
+# for the asyncio engine. Module level, so warm invocations reuse it.
+FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_FETCH_THREADS, thread_name_prefix='idot-fetch')
+
+
+async def run_blocking(func, *args):
+    """Run a blocking fetch/parse function on FETCH_EXECUTOR, in the caller's context"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(FETCH_EXECUTOR, contextvars.copy_context().run, func, *args)
+
+
+async def fetch_repository_rows_async(repo_url, deadline=None, max_age=0):
+    """
+    Fetch the repository page and return its rows in scope (see
+    parse_repository_rows). By default the page is always revalidated,
+    since contract statuses change.
+    """
+    # Fetch and parse the repository page as it downloads. Concurrent
+    # scrapes of the letting (streams, jobs, requests) share one fetch.
+    repository_rows = await run_blocking(
+        lambda: REPOSITORY_FETCHES.do(
+            (repo_url, max_age),
+            lambda: parse_repository_rows(stream_url(repo_url, max_age=max_age, deadline=deadline), repo_url),
+            deadline=deadline
+        )
+    )
+    
+    if not repository_rows:
         raise Exception("No matching contracts found. Check the URL and filter criteria.")
+    if CONTRACT_STORE:
+        await run_blocking(CONTRACT_STORE.save_listing, repo_url, repository_rows)
+    return repository_rows
+
+
+class CsvEmitter:
+    """
+    Turns contract rows into CSV one line at a time. Each line is written
+    into a small reusable buffer and handed back straight away (as bytes
+    if an encoding is given), so no copy of the whole output is kept.
+    rows_written counts the data rows emitted so far.
+    """
+    def __init__(self, encoding=None, fieldnames=CSV_FIELDS):
+        self.encoding = encoding
+        self.buffer = StringIO()
+        self.writer = csv.DictWriter(self.buffer, fieldnames=fieldnames)
+        self.rows_written = 0
     
-    # Scrape each contract
-    for contract_url in contract_urls:
+    def _take(self):
+        line = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return line.encode(self.encoding) if self.encoding else line
+    
+    def header(self):
+        self.writer.writeheader()
+        return self._take()
+    
+    def row(self, row):
+        self.writer.writerow(row)
+        self.rows_written += 1
+        return self._take()
+    
+    def iter_csv(self, rows):
+        """Yield the header line, then one line per row as rows are produced"""
+        yield self.header()
+        for row in rows:
+            yield self.row(row)
+
+
+def results_to_csv(results):
+    """Convert scraped contract rows to CSV text and the number of rows written"""
+    emitter = CsvEmitter()
+    return ''.join(emitter.iter_csv(results)), emitter.rows_written
+
+
+def new_progress():
+    """Counters a scrape updates as it goes (see process_repository_async)"""
+    return {'total': None, 'done': 0, 'errors': 0}
+
+
+async def scrape_contracts_async(contract_urls, max_concurrency=MAX_CONCURRENT_FETCHES, deadline=None, progress=None,
+                                 on_row=None, max_age=CACHE_FRESH_SECONDS):
+    """
+    Scrape contract pages until deadline and return {contract_url: row} for
+    the ones that finished. Pages already fresh in the cache are scheduled
+    first since they cost no request. A fetch is only started if the time
+    observed for fetches so far says it can finish before the deadline, and
+    fetches still running at the deadline are abandoned (each row is saved
+    to CONTRACT_STORE in the fetch thread, so their work is not lost).
+    If on_row is given, each row is passed to on_row(row, progress) as soon
+    as it is scraped and is not kept: the returned dict maps to None.
+    max_age is passed on to scrape_contract.
+    """
+    if progress is None:
+        progress = new_progress()
+    progress['total'] = progress['done'] + len(contract_urls)
+    if not contract_urls:
+        return {}
+    cached = set()
+    if RESPONSE_CACHE and max_age > 0:
+        cached = await run_blocking(lambda: {url for url in contract_urls if RESPONSE_CACHE.has_fresh(url, max_age)})
+    ordered_urls = sorted(contract_urls, key=lambda url: url not in cached)
+    
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    results = {}
+    estimate = FETCH_TIME_ESTIMATE
+    
+    def scrape_and_store(contract_url):
         try:
-            contract_html = fetch_url(contract_url)
-            data = scrape_contract_detail(contract_html)
-            
-            results.append({
-                'contract_url': contract_url,
-                'low_bidder': data['low_bidder'],
-                'low_bid_amount': data['low_bid_amount'],
-                'awardee': data['awardee']
+            row = scrape_contract(contract_url, deadline, max_age)
+        except DeadlineExceeded:
+            return None
+        if CONTRACT_STORE:
+            CONTRACT_STORE.save_row(row)
+        return row
+    
+    async def scrape_scheduled(contract_url):
+        nonlocal estimate
+        async with semaphore:
+            is_cached = contract_url in cached
+            if deadline is not None and time.time() + (0 if is_cached else estimate) > deadline:
+                return
+            started = time.time()
+            row = await run_blocking(scrape_and_store, contract_url)
+            if row is None:
+                # Ran out of time: left out of the results, so still to do
+                return
+            progress['done'] += 1
+            if row['low_bidder'].startswith('ERROR:'):
+                progress['errors'] += 1
+            if on_row is None:
+                results[contract_url] = row
+            else:
+                results[contract_url] = None
+                on_row(row, progress)
+            if not is_cached:
+                # Moving average of network fetch times
+                estimate = 0.7 * estimate + 0.3 * (time.time() - started)
+    
+    tasks = [asyncio.ensure_future(scrape_scheduled(url)) for url in ordered_urls]
+    timeout = None if deadline is None else max(0, deadline - time.time())
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    return results
+
+
+class ContinuationError(ValueError):
+    """Raised for a continuation token that is malformed or does not match the request"""
+
+
+def listing_digest(contract_urls):
+    """Short hash identifying a repository's filtered contract list"""
+    return hashlib.sha256('\n'.join(contract_urls).encode('utf-8')).hexdigest()[:16]
+
+
+def make_continuation_token(repo_url, contract_urls, remaining_urls, started):
+    """
+    Encode where a scrape stopped: the repository URL, a digest of its
+    filtered contract list, a bitmask of which contracts are still to do
+    and when the scrape started. The contract URLs themselves are not included (they are read again
+    from the repository page), so the token stays small even for big
+    lettings. It is compressed JSON in URL-safe base64, so the client can
+    send it back as is.
+    """
+    remaining = set(remaining_urls)
+    mask = bytearray((len(contract_urls) + 7) // 8)
+    for i, url in enumerate(contract_urls):
+        if url in remaining:
+            mask[i // 8] |= 1 << (i % 8)
+    state = {
+        'v': 2,
+        'repo_url': repo_url,
+        'listing': listing_digest(contract_urls),
+        'count': len(contract_urls),
+        'remaining': mask.hex(),
+        'started': int(started)
+    }
+    packed = zlib.compress(json.dumps(state, separators=(',', ':')).encode('utf-8'), 9)
+    return base64.urlsafe_b64encode(packed).decode('ascii')
+
+
+def read_continuation_token(token):
+    """
+    Decode a continuation token into (repo_url, listing digest, contract
+    count, remaining bitmask, start time). The bitmask is only expanded by
+    resume_contract_urls, once the count has been checked against the
+    repository.
+    """
+    try:
+        decompressor = zlib.decompressobj()
+        packed = decompressor.decompress(base64.urlsafe_b64decode(token.encode('ascii')),
+                                         MAX_CONTINUATION_TOKEN_BYTES)
+        if decompressor.unconsumed_tail:
+            raise ContinuationError("Invalid continuation token")
+        state = json.loads(packed)
+        version = state.get('v')
+    except (ValueError, TypeError, AttributeError, zlib.error):
+        raise ContinuationError("Invalid continuation token")
+    if version != 2:
+        raise ContinuationError("Unsupported continuation token version")
+    try:
+        repo_url, listing, count = state['repo_url'], state['listing'], state['count']
+        mask = bytes.fromhex(state['remaining'])
+        started = float(state['started'])
+    except (ValueError, TypeError, KeyError):
+        raise ContinuationError("Invalid continuation token")
+    if (not isinstance(repo_url, str) or not isinstance(listing, str)
+            or type(count) is not int or not 0 <= count <= MAX_CONTINUATION_CONTRACTS
+            or len(mask) != (count + 7) // 8):
+        raise ContinuationError("Invalid continuation token")
+    return repo_url, listing, count, mask, started
+
+
+def resume_contract_urls(repository_rows, listing, count, mask):
+    """The contract URLs a continuation token says are left, checked against the repository's current rows"""
+    contract_urls = [row['contract_url'] for row in repository_rows]
+    if len(contract_urls) != count or listing_digest(contract_urls) != listing:
+        raise ContinuationError("The repository's contract list has changed since this scrape started; "
+                                "start a new scrape")
+    return contract_urls, [url for i, url in enumerate(contract_urls) if mask[i // 8] >> (i % 8) & 1]
+
+
+async def process_repository_async(repo_url, max_concurrency=MAX_CONCURRENT_FETCHES, deadline=None, continuation=None,
+                                   progress=None, on_row=None, incremental=True):
+    """
+    Asyncio version of process_repository. Every contract is scheduled on
+    the event loop at once; a semaphore keeps at most max_concurrency of
+    them fetching.
+    deadline is a time.time() timestamp (default SCRAPE_TIME_BUDGET from
+    now). Work that cannot finish before it is left out and reported, so
+    the result is returned before the platform kills the invocation:
+        {'csv': CSV of finished rows, in repository order,
+         'contracts': number of rows in the CSV,
+         'reused': how many of them were read from CONTRACT_STORE,
+         'transfer': TransferStats snapshot of this scrape's downloads (pages
+                     shared from another scrape's in-flight fetch count zero),
+         'remaining_urls': contract URLs not scraped,
+         'complete': True if nothing remains,
+         'continuation': token to pass back to resume, or None}
+    continuation is a token decoded by read_continuation_token: the
+    repository page is read again (normally from the cache) and only the
+    contracts the token lists as remaining are scraped.
+    progress, if given, is a new_progress() dict updated while scraping.
+    on_row, if given, is called as on_row(index, row, progress) as each row
+    is scraped, index being the contract's position in the repository's
+    filtered list (stable across continuations). Rows are then not
+    collected and 'csv' is None.
+    If incremental, contracts whose repository row is unchanged since they
+    were last scraped are not fetched again: their stored row is used.
+    Otherwise (a refresh) every contract page is revalidated with IDOT.
+    """
+    if deadline is None:
+        deadline = time.time() + SCRAPE_TIME_BUDGET
+    transfer_stats = TransferStats()
+    CURRENT_TRANSFER_STATS.set(transfer_stats)
+    started = time.time()
+    
+    if continuation:
+        token_repo_url, listing, count, mask, started = continuation
+        if repo_url and repo_url != token_repo_url:
+            raise ContinuationError("Continuation token belongs to a different repository URL")
+        repo_url = token_repo_url
+        # The page seen by the first call is normally still in the cache
+        repository_rows = await fetch_repository_rows_async(repo_url, deadline, max_age=CACHE_FRESH_SECONDS)
+        contract_urls, todo_urls = resume_contract_urls(repository_rows, listing, count, mask)
+    else:
+        repository_rows = await fetch_repository_rows_async(repo_url, deadline)
+        contract_urls = [row['contract_url'] for row in repository_rows]
+        todo_urls = contract_urls
+    
+    # Contracts listed exactly as when they were last scraped keep their
+    # stored row. When continuing, only rows scraped since the scrape
+    # started count: fetches that finished after an earlier call's deadline.
+    stored = {}
+    if CONTRACT_STORE and (incremental or continuation):
+        todo = set(todo_urls)
+        stored = await run_blocking(
+            CONTRACT_STORE.unchanged_rows,
+            [row for row in repository_rows if row['contract_url'] in todo],
+            started if continuation else None
+        )
+        todo_urls = [url for url in todo_urls if url not in stored]
+    
+    if progress is None:
+        progress = new_progress()
+    progress['total'] = len(stored) + len(todo_urls)
+    report_row = None
+    if on_row:
+        positions = {url: i for i, url in enumerate(contract_urls)}
+        report_row = lambda row, row_progress: on_row(positions[row['contract_url']], row, row_progress)
+        for row in stored.values():
+            progress['done'] += 1
+            report_row(row, progress)
+    else:
+        progress['done'] += len(stored)
+    
+    # With the store, every contract fetched is new or changed since its
+    # last scrape, and a refresh wants current pages: either way a cached
+    # copy of the page could hold old bid fields
+    max_age = 0 if CONTRACT_STORE or not incremental else CACHE_FRESH_SECONDS
+    results = await scrape_contracts_async(todo_urls, max_concurrency, deadline, progress, report_row, max_age)
+    results.update(stored)
+    remaining_urls = [url for url in todo_urls if url not in results]
+    if on_row:
+        csv_content, scraped = None, len(results)
+    else:
+        csv_content, scraped = results_to_csv(results[url] for url in contract_urls if url in results)
+    
+    return {
+        'csv': csv_content,
+        'contracts': scraped,
+        'reused': len(stored),
+        'remaining_urls': remaining_urls,
+        'complete': not remaining_urls,
+        'continuation': make_continuation_token(repo_url, contract_urls, remaining_urls, started) if remaining_urls else None,
+        'transfer': transfer_stats.snapshot()
+    }
+
+
+def process_repository(repo_url, max_workers=MAX_CONCURRENT_FETCHES, deadline=None, continuation=None, progress=None,
+                       on_row=None, incremental=True):
+    """Main processing function that orchestrates the scraping workflow"""
+    return asyncio.run(process_repository_async(repo_url, max_workers, deadline, continuation, progress, on_row,
+                                                incremental))
+
+
+def scrape_summary(result):
+    """Human readable summary of a process_repository result"""
+    reused = f' ({result["reused"]} reused from earlier runs)' if result.get('reused') else ''
+    if result['complete']:
+        return f'Successfully scraped {result["contracts"]} contracts{reused}'
+    return (f'Time limit reached: scraped {result["contracts"]} contracts{reused}, '
+            f'{len(result["remaining_urls"])} remaining')
+
+
+class ResultCache:
+    """
+    Complete process_repository results by repository URL and filter
+    settings, kept for ttl seconds. Holds at most max_entries results and
+    max_bytes of CSV, evicting the least recently used first.
+    """
+    def __init__(self, ttl=RESULT_CACHE_SECONDS, max_entries=RESULT_CACHE_MAX_ENTRIES,
+                 max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+    
+    def key(self, repo_url):
+        return json.dumps([normalize_repo_url(repo_url), sorted(VALID_COUNTIES), sorted(VALID_STATUSES)])
+    
+    def get(self, repo_url):
+        """Return (result, age in seconds) for repo_url, or (None, None) if not cached"""
+        key = self.key(repo_url)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, None
+            age = time.time() - entry['stored_at']
+            if age > self.ttl:
+                self._remove(key)
+                return None, None
+            self.entries.move_to_end(key)
+            return entry['result'], age
+    
+    def put(self, repo_url, result):
+        """Remember a result; partial results are not cached"""
+        size = len(result['csv'] or '')
+        if not result['complete'] or size > self.max_bytes:
+            return
+        key = self.key(repo_url)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = {'result': result, 'stored_at': time.time(), 'size': size}
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+    
+    def invalidate(self, repo_url):
+        with self.lock:
+            self._remove(self.key(repo_url))
+    
+    def _remove(self, key):
+        # Called with the lock held
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.total_bytes -= entry['size']
+
+
+RESULT_CACHE = ResultCache()
+
+
+def scrape_letting(repo_url, deadline=None, refresh=False, progress=None, coalesce=True):
+    """
+    process_repository through RESULT_CACHE. Returns (result, age): age is
+    the cached result's age in seconds, or None if it was just scraped.
+    A complete new result is stored in the cache. refresh skips the cached
+    result and re-scrapes every contract, revalidating each page instead of
+    using the page cache. With coalesce, concurrent calls for the same
+    letting share one scrape and all get its result.
+    """
+    if not refresh:
+        result, age = RESULT_CACHE.get(repo_url)
+        if result is not None:
+            if progress is not None:
+                progress.update(total=result['contracts'], done=result['contracts'])
+            return result, age
+    
+    def run():
+        result = process_repository(repo_url, deadline=deadline, progress=progress, incremental=not refresh)
+        RESULT_CACHE.put(repo_url, result)
+        return result
+    if not coalesce:
+        return run(), None
+    return LETTING_SCRAPES.do((RESULT_CACHE.key(repo_url), refresh), run, deadline=deadline), None
+
+
+def iter_scrape_events(repo_url, continuation=None, deadline=None, refresh=False):
+    """
+    Run a scrape and yield its progress as events, each row as soon as its
+    contract is scraped:
+        {'type': 'start', 'repo_url': ...}
+        {'type': 'row', 'index': ..., 'row': {...}, 'progress': {...}}   (completion order)
+        {'type': 'done', 'message': ..., 'complete': ..., 'remaining_urls': [...], 'continuation': ...}
+        {'type': 'error', 'error': ...}
+    continuation, if given, is a decoded token (see read_continuation_token).
+    Rows are handed over through a queue and not kept as dicts. A fresh
+    (not continued) scrape of a small letting also keeps each row's CSV
+    line, up to STREAM_CACHE_MAX_BYTES, so a complete run can be stored in
+    RESULT_CACHE; past that the lines are dropped and nothing is cached.
+    """
+    events = queue.Queue()
+    emitter = CsvEmitter()
+    lines = None if continuation else {}
+    kept_bytes = 0
+    
+    def on_row(index, row, progress):
+        nonlocal lines, kept_bytes
+        if lines is not None:
+            lines[index] = emitter.row(row)
+            kept_bytes += len(lines[index])
+            if kept_bytes > STREAM_CACHE_MAX_BYTES:
+                lines = None
+        events.put({'type': 'row', 'index': index, 'row': row, 'progress': dict(progress)})
+    
+    def run():
+        try:
+            result = process_repository(repo_url, deadline=deadline, continuation=continuation, on_row=on_row,
+                                        incremental=not refresh)
+            if lines is not None and result['complete']:
+                csv_content = emitter.header() + ''.join(lines[index] for index in sorted(lines))
+                RESULT_CACHE.put(repo_url, dict(result, csv=csv_content))
+            events.put({
+                'type': 'done',
+                'message': scrape_summary(result),
+                'contracts': result['contracts'],
+                'complete': result['complete'],
+                'remaining_urls': result['remaining_urls'],
+                'continuation': result['continuation']
             })
         except Exception as e:
-            results.append({
-                'contract_url': contract_url,
-                'low_bidder': f'ERROR: {str(e)}',
-                'low_bid_amount': '',
-                'awardee': ''
-            })
+            events.put({'type': 'error', 'error': str(e)})
+        events.put(None)
+    
+    threading.Thread(target=run, name='idot-stream', daemon=True).start()
+    yield {'type': 'start', 'repo_url': repo_url}
+    while True:
+        event = events.get()
+        if event is None:
+            return
+        yield event
+
+
+def iter_cached_events(repo_url, result, age):
+    """The events of iter_scrape_events replayed from a cached result (rows in repository order)"""
+    yield {'type': 'start', 'repo_url': repo_url, 'cached_age': int(age)}
+    progress = {'total': result['contracts'], 'done': 0, 'errors': 0}
+    for index, row in enumerate(csv.DictReader(StringIO(result['csv']))):
+        progress['done'] += 1
+        if row['low_bidder'].startswith('ERROR:'):
+            progress['errors'] += 1
+        yield {'type': 'row', 'index': index, 'row': row, 'progress': dict(progress)}
+    yield {
+        'type': 'done',
+        'message': scrape_summary(result),
+        'contracts': result['contracts'],
+        'complete': result['complete'],
+        'remaining_urls': result['remaining_urls'],
+        'continuation': result['continuation']
+    }
+
+
+def format_ndjson(events):
+    """Encode events as newline-delimited JSON"""
+    for event in events:
+        yield json.dumps(event) + '\n'
+
+
+def format_sse(events):
+    """Encode events as Server-Sent Events"""
+    for event in events:
+        yield f'event: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+
+
+def format_csv(events, emitter=None):
+    """
+    Encode the rows of a scrape event stream as CSV lines, in completion
+    order. An error after the header has gone out can only be signalled by
+    cutting the response short, so it is raised.
+    """
+    emitter = emitter or CsvEmitter(encoding='utf-8')
+    yield emitter.header()
+    for event in events:
+        if event['type'] == 'row':
+            yield emitter.row(event['row'])
+        elif event['type'] == 'error':
+            raise Exception(event['error'])
+
+
+class JobStoreFull(Exception):
+    """Raised when MAX_STORED_JOBS jobs are already queued, running or kept"""
+
+
+class JobStore:
+    """
+    Runs scrapes in the background for the job API. Jobs wait in the
+    executor's queue, at most MAX_RUNNING_JOBS run at once, and finished
+    jobs are kept for JOB_RETENTION_SECONDS so their CSV can be collected.
+    """
+    def __init__(self, max_running=MAX_RUNNING_JOBS, retention=JOB_RETENTION_SECONDS, max_jobs=MAX_STORED_JOBS):
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix='idot-job')
+    
+    def submit(self, repo_url, refresh=False):
+        """Queue a scrape of repo_url and return its job"""
+        job = {
+            'id': uuid.uuid4().hex,
+            'repo_url': repo_url,
+            'refresh': refresh,
+            'status': 'queued',
+            'created_at': time.time(),
+            'finished_at': None,
+            'progress': new_progress(),
+            'result': None,
+            'error': None
+        }
+        with self.lock:
+            self._prune()
+            if len(self.jobs) >= self.max_jobs:
+                raise JobStoreFull("Too many jobs in progress, try again later")
+            self.jobs[job['id']] = job
+        self.executor.submit(self._run, job)
+        return job
+    
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+    
+    def _run(self, job):
+        job['status'] = 'running'
+        try:
+            # Not coalesced: a request sharing a job's scrape would wait
+            # past its own time limit for the job's much longer one
+            job['result'], _ = scrape_letting(job['repo_url'], deadline=time.time() + JOB_TIME_BUDGET,
+                                              refresh=job['refresh'], progress=job['progress'], coalesce=False)
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        job['finished_at'] = time.time()
     
-    # Convert to CSV
-    output = StringIO()
-    writer = csv.DictWriter(output, fieldnames=['contract_url', 'low_bidder', 'low_bid_amount', 'awardee'])
-    writer.writeheader()
-    writer.writerows(results)
+    def _prune(self):
+        # Called with the lock held: forget finished jobs past retention
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job['finished_at'] and now - job['finished_at'] > self.retention:
+                del self.jobs[job_id]
     
-    return output.getvalue()
+    def describe(self, job):
+        """The job's public status, without the CSV"""
+        status = {
+            'job_id': job['id'],
+            'repo_url': job['repo_url'],
+            'status': job['status'],
+            'progress': dict(job['progress'])
+        }
+        if job['status'] == 'done':
+            result = job['result']
+            status['message'] = scrape_summary(result)
+            status['complete'] = result['complete']
+            status['remaining_urls'] = result['remaining_urls']
+            status['continuation'] = result['continuation']
+        elif job['status'] == 'failed':
+            status['error'] = job['error']
+        return status
+
+
+JOB_STORE = JobStore()
+
+
+def json_response(status_code, payload):
+    """Build a JSON response in the serverless function's format"""
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(payload)
+    }
+
+
+def add_cache_headers(response, age):
+    """Mark a response as served from RESULT_CACHE (age in seconds) or freshly scraped (age None)"""
+    headers = response['headers']
+    headers['X-Result-Cache'] = 'miss' if age is None else 'hit'
+    if age is not None:
+        headers['Age'] = str(int(age))
+    exposed = headers.get('Access-Control-Expose-Headers')
+    headers['Access-Control-Expose-Headers'] = f'{exposed}, Age, X-Result-Cache' if exposed else 'Age, X-Result-Cache'
+    return response
+
+
+def get_header(request, name):
+    """Return a request header (case-insensitive), or '' if it is missing"""
+    headers = getattr(request, 'headers', None) or {}
+    value = headers.get(name) or headers.get(name.lower())
+    if value is None and hasattr(headers, 'items'):
+        value = next((v for k, v in headers.items() if k.lower() == name.lower()), None)
+    return value or ''
+
+
+def get_query_params(request):
+    """Return the request's query string parameters as a dict"""
+    params = getattr(request, 'args', None) or getattr(request, 'query', None)
+    if params is not None and hasattr(params, 'get'):
+        return params
+    url = getattr(request, 'url', None) or getattr(request, 'path', None) or ''
+    return {name: values[-1] for name, values in parse_qs(urlsplit(url).query).items()}
+
+
+def handle_job_request(request):
+    """GET /api/scrape?job=<id>[&format=csv]: job status, or its CSV once done"""
+    params = get_query_params(request)
+    job_id = params.get('job')
+    if not job_id:
+        return json_response(400, {'error': 'No job id provided'})
+    
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        return json_response(404, {'error': 'Unknown or expired job'})
+    
+    if params.get('format') != 'csv':
+        return json_response(200, JOB_STORE.describe(job))
+    
+    if job['status'] != 'done':
+        return json_response(409, {'error': f'Job is {job["status"]}, no CSV available'})
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/csv; charset=utf-8',
+            'Content-Disposition': f'attachment; filename="idot_contracts_{job_id}.csv"',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': job['result']['csv']
+    }
+
+
+def choose_encoding(accept_encoding):
+    """Pick 'br' or 'gzip' from an Accept-Encoding header, or None for no compression"""
+    weights = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            weights[coding] = q
+    offered = ['br', 'gzip'] if brotli else ['gzip']
+    choices = [(weights.get(coding, weights.get('*', 0.0)), -i, coding) for i, coding in enumerate(offered)]
+    q, _, coding = max(choices)
+    return coding if q > 0 else None
+
+
+def iter_compressed(chunks, coding):
+    """Compress a stream of str/bytes chunks, flushing after each so it still streams"""
+    if coding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response, accept_encoding):
+    """
+    Compress a handler response for a client sending accept_encoding.
+    A generator body becomes a generator of compressed bytes; any other
+    body of COMPRESS_MIN_BYTES or more is compressed and base64 encoded
+    (isBase64Encoded), as the serverless platform expects binary bodies.
+    """
+    body = response.get('body')
+    headers = response.setdefault('headers', {})
+    streamed = body is not None and not isinstance(body, (str, bytes))
+    if body is None or 'Content-Encoding' in headers or (not streamed and len(body) < COMPRESS_MIN_BYTES):
+        return response
+    headers['Vary'] = 'Accept-Encoding'
+    coding = choose_encoding(accept_encoding)
+    if coding is None:
+        return response
+    
+    headers['Content-Encoding'] = coding
+    if streamed:
+        response['body'] = iter_compressed(body, coding)
+        return response
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if coding == 'br':
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        body = compressor.compress(body) + compressor.flush()
+    response['body'] = base64.b64encode(body).decode('ascii')
+    response['isBase64Encoded'] = True
+    return response
+
+
+def handle_store_request(request):
+    """GET /api/scrape?letting=<url>&county=<name>&bidder=<name>[&format=csv]: stored contracts"""
+    if CONTRACT_STORE is None:
+        return json_response(404, {'error': 'The contract store is disabled'})
+    params = get_query_params(request)
+    try:
+        limit = int(params.get('limit') or STORE_QUERY_LIMIT)
+    except ValueError:
+        return json_response(400, {'error': 'limit must be a number'})
+    limit = min(max(limit, 1), STORE_QUERY_LIMIT)
+    try:
+        contracts = CONTRACT_STORE.query(params.get('letting'), params.get('county'), params.get('bidder'), limit)
+    except (sqlite3.Error, OSError) as e:
+        return json_response(500, {'error': f'Could not read the contract store: {e}'})
+    
+    if params.get('format') != 'csv':
+        return json_response(200, {'contracts': contracts})
+    emitter = CsvEmitter(fieldnames=list(contracts[0]) if contracts else CSV_FIELDS)
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/csv; charset=utf-8',
+            'Content-Disposition': 'attachment; filename="idot_contracts_stored.csv"',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': ''.join(emitter.iter_csv(contracts))
+    }
 
 
 # This is the Vercel serverless function entry point
@@ -208,28 +2127,35 @@ def handler(request):
     Vercel serverless function handler.
     This function is called when a request comes to /api/scrape
     """
+    return compress_response(handle_request(request), get_header(request, 'Accept-Encoding'))
+
+
+def handle_request(request):
+    """Answer a request to /api/scrape (uncompressed)"""
     # Handle CORS preflight
     if request.method == 'OPTIONS':
         return {
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, Cache-Control'
             },
             'body': ''
         }
     
-    # Only accept POST requests
+    # GET polls background jobs or queries stored contracts; a bare GET
+    # is neither
+    if request.method == 'GET':
+        params = get_query_params(request)
+        if params.get('job'):
+            return handle_job_request(request)
+        if params:
+            return handle_store_request(request)
+    
+    # Otherwise only accept POST requests
     if request.method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
+        return json_response(405, {'error': 'Method not allowed'})
     
     try:
         # Parse the request body
@@ -241,42 +2167,109 @@ def handler(request):
         else:
             data = request.json if hasattr(request, 'json') else {}
         
-        repo_url = data.get('repo_url', '').strip()
+        repo_url = (data.get('repo_url') or '').strip()
+        continuation = data.get('continuation')
         
-        if not repo_url:
-            return {
-                'statusCode': 400,
+        if not repo_url and not continuation:
+            return json_response(400, {'error': 'No repository URL provided'})
+        
+        # Decode a continuation token once, up front, so a bad one is a 400
+        resume = None
+        if continuation:
+            try:
+                resume = read_continuation_token(continuation)
+            except ContinuationError as e:
+                return json_response(400, {'error': str(e)})
+        
+        # A letting scraped recently is answered from RESULT_CACHE unless
+        # the client asks for a refresh
+        refresh = bool(data.get('refresh')) or 'no-cache' in get_header(request, 'Cache-Control').lower()
+        
+        # Job mode: queue the scrape and answer straight away
+        if data.get('job'):
+            if not repo_url:
+                return json_response(400, {'error': 'Jobs need a repository URL'})
+            try:
+                job = JOB_STORE.submit(repo_url, refresh)
+            except JobStoreFull as e:
+                response = json_response(503, {'error': str(e)})
+                response['headers']['Retry-After'] = '60'
+                return response
+            status = JOB_STORE.describe(job)
+            status['status_url'] = f'/api/scrape?job={job["id"]}'
+            status['csv_url'] = f'/api/scrape?job={job["id"]}&format=csv'
+            return json_response(202, status)
+        
+        # Streaming mode: send each row as it is scraped. The body is a
+        # generator of chunks, written out as they are produced.
+        accept = get_header(request, 'Accept')
+        wants_csv = data.get('format') == 'csv' or 'text/csv' in accept
+        cached, age = (None, None) if continuation or refresh else RESULT_CACHE.get(repo_url)
+        if data.get('stream') or 'application/x-ndjson' in accept or 'text/event-stream' in accept:
+            if cached:
+                events = iter_cached_events(repo_url, cached, age)
+            else:
+                events = iter_scrape_events(repo_url, resume, time.time() + SCRAPE_TIME_BUDGET, refresh)
+            if wants_csv:
+                # Wait for the first row so a failed repository fetch still
+                # gets an error status instead of an empty CSV
+                first = next(event for event in events if event['type'] != 'start')
+                if first['type'] == 'error':
+                    return json_response(500, {'error': first['error']})
+                content_type, body = 'text/csv; charset=utf-8', format_csv(itertools.chain([first], events))
+            elif 'text/event-stream' in accept:
+                content_type, body = 'text/event-stream', format_sse(events)
+            else:
+                content_type, body = 'application/x-ndjson', format_ndjson(events)
+            response = {
+                'statusCode': 200,
                 'headers': {
-                    'Content-Type': 'application/json',
+                    'Content-Type': content_type,
+                    'Cache-Control': 'no-cache',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'error': 'No repository URL provided'})
+                'body': body
             }
+            return add_cache_headers(response, age)
         
-        # Process the repository
-        csv_content = process_repository(repo_url)
+        # Process the repository, stopping in time to return partial results
+        deadline = time.time() + SCRAPE_TIME_BUDGET
+        if cached:
+            result = cached
+        else:
+            try:
+                if continuation:
+                    result = process_repository(repo_url, deadline=deadline, continuation=resume)
+                else:
+                    result, age = scrape_letting(repo_url, deadline, refresh)
+            except ContinuationError as e:
+                return json_response(400, {'error': str(e)})
+        
+        # CSV mode: the CSV is the body, the rest of the outcome goes in headers
+        if wants_csv:
+            headers = {
+                'Content-Type': 'text/csv; charset=utf-8',
+                'Content-Disposition': 'attachment; filename="idot_contracts.csv"',
+                'X-Scrape-Contracts': str(result['contracts']),
+                'X-Scrape-Complete': 'true' if result['complete'] else 'false',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'X-Scrape-Contracts, X-Scrape-Complete, X-Scrape-Continuation'
+            }
+            if result['continuation']:
+                headers['X-Scrape-Continuation'] = result['continuation']
+            return add_cache_headers({'statusCode': 200, 'headers': headers, 'body': result['csv']}, age)
         
         # Return success response
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'success': True,
-                'csv': csv_content,
-                'message': f'Successfully scraped {csv_content.count(chr(10)) - 1} contracts'
-            })
-        }
+        return add_cache_headers(json_response(200, {
+            'success': True,
+            'csv': result['csv'],
+            'message': scrape_summary(result),
+            'complete': result['complete'],
+            'remaining_urls': result['remaining_urls'],
+            'continuation': result['continuation'],
+            'transfer': result['transfer'] if age is None else NO_TRANSFER
+        }), age)
         
     except Exception as e:
         # Return error response
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': str(e)})
-        }
+        return json_response(500, {'error': str(e)})
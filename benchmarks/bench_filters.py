@@ -0,0 +1,76 @@
+"""
+Benchmark for the county/status row filter used by parse_repository_page.
+
+Compares, on the rows of large synthetic repository pages:
+  - substring scans: any(term in row_text ...) for each set (the original)
+  - combined: one alternation of every term, classifying each hit in Python
+  - matches_filters: one precompiled alternation per set (current)
+
+The combined single-pass regex looks attractive but the Python loop over
+its hits costs more than it saves; one search per set stays in C and
+stops at the first hit.
+
+Run from the repository root:
+    python benchmarks/bench_filters.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import scrape  # noqa: E402
+from bench_repository import synthetic_letting  # noqa: E402
+
+COMBINED_PATTERN = scrape.compile_terms(scrape.VALID_COUNTIES | scrape.VALID_STATUSES)
+
+
+def substring_scans(text):
+    has_valid_county = any(county in text for county in scrape.VALID_COUNTIES)
+    has_valid_status = any(status in text for status in scrape.VALID_STATUSES)
+    return has_valid_county and has_valid_status
+
+
+def combined_pattern(text):
+    found_county = found_status = False
+    for match in COMBINED_PATTERN.finditer(text):
+        term = match.group()
+        found_county = found_county or term in scrape.VALID_COUNTIES
+        found_status = found_status or term in scrape.VALID_STATUSES
+        if found_county and found_status:
+            return True
+    return False
+
+
+def best_of(matcher, rows, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for row_text in rows:
+            matcher(row_text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    matchers = [
+        ('substring scans', substring_scans),
+        ('combined regex', combined_pattern),
+        ('matches_filters', scrape.matches_filters),
+    ]
+    print(f"{'rows':>7} " + ' '.join(f'{name + " (ms)":>20}' for name, _ in matchers))
+    for size in (5000, 20000, 80000):
+        parser = scrape.SimpleHTMLParser()
+        parser.feed(synthetic_letting(size))
+        rows = [' '.join(row).lower() for table in parser.tables for row in table]
+        expected = [substring_scans(text) for text in rows]
+        timings = []
+        for _, matcher in matchers:
+            assert [matcher(text) for text in rows] == expected
+            timings.append(best_of(matcher, rows) * 1000)
+        print(f'{size:>7} ' + ' '.join(f'{t:20.2f}' for t in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark for SimpleHTMLParser cell accumulation.
+
+Builds pathological detail pages where a single cell is delivered to the
+parser in many fragments (inline tags between bidder name pieces, fed in
+small chunks like stream_url does) and times the current parser against
+the old string-concatenation version. Doubling the fragment count should
+roughly double the time for SimpleHTMLParser (linear) while the old
+version grows about four-fold (quadratic).
+
+Run from the repository root:
+    python benchmarks/bench_parser.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from scrape import SimpleHTMLParser  # noqa: E402
+
+
+class ConcatHTMLParser(SimpleHTMLParser):
+    """The previous parser behaviour: cell text built with +="""
+    def handle_starttag(self, tag, attrs):
+        super().handle_starttag(tag, attrs)
+        if tag in ['td', 'th'] and self.in_cell:
+            self.current_cell = ''
+
+    def handle_endtag(self, tag):
+        if tag in ['td', 'th'] and self.in_cell:
+            self.in_cell = False
+            self.current_row.append(self.current_cell.strip())
+            return
+        super().handle_endtag(tag)
+
+    def handle_data(self, data):
+        if self.in_cell:
+            self.current_cell += data
+
+
+def pathological_page(fragments):
+    """A one-cell table whose text is split into `fragments` pieces by inline tags"""
+    cell = '<b></b>'.join('Remarks &amp; Bidder Name' for _ in range(fragments))
+    return f'<html><body><table><tr><td>{cell}</td></tr></table></body></html>'
+
+
+def time_parser(parser_class, page, chunk_size=1024, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser = parser_class()
+        for i in range(0, len(page), chunk_size):
+            parser.feed(page[i:i + chunk_size])
+        parser.close()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'fragments':>10} {'concat (s)':>12} {'x prev':>7} {'fragments (s)':>14} {'x prev':>7}")
+    previous = None
+    for fragments in (5000, 10000, 20000, 40000, 80000):
+        page = pathological_page(fragments)
+        concat = time_parser(ConcatHTMLParser, page)
+        linear = time_parser(SimpleHTMLParser, page)
+        if previous:
+            growth = f'{concat / previous[0]:7.2f} {linear:14.4f} {linear / previous[1]:7.2f}'
+        else:
+            growth = f"{'':>7} {linear:14.4f} {'':>7}"
+        print(f'{fragments:>10} {concat:12.4f} {growth}')
+        previous = (concat, linear)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark for parse_repository_page on large synthetic lettings.
+
+Generates repository pages with thousands of contract rows and compares
+parse_repository_page against the original list-based version, which
+deduplicated with `not in` on a list and consumed matches with pop(0).
+(That version also paired rows with links by position, so only the number
+of URLs, not the URLs themselves, is expected to agree.)
+The HTML parsing time, shared by both, is reported separately so the
+remaining filter/matching cost is visible.
+
+Run from the repository root:
+    python benchmarks/bench_repository.py
+"""
+
+import os
+import sys
+import time
+from urllib.parse import urljoin
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import scrape  # noqa: E402
+
+BASE_URL = 'https://webapps1.dot.illinois.gov/WCTB/LbLettingDetail/12345'
+COUNTIES = ['Cook', 'Will', 'Peoria', 'Lake', 'Sangamon', 'DuPage', 'Champaign']
+STATUSES = ['Active', 'Executed', 'Withdrawn', 'Awarded', 'Rejected']
+
+
+def synthetic_letting(rows):
+    """A repository page with one table of `rows` contracts"""
+    parts = ['<html><body><table>',
+             '<tr><th>Item</th><th>Contract</th><th>County</th><th>Description</th><th>Status</th></tr>']
+    for i in range(rows):
+        parts.append(
+            f'<tr><td>{i}</td>'
+            f'<td><a href="/WCTB/LbContractDetail/{i}">C{i:05d}</a></td>'
+            f'<td>{COUNTIES[i % len(COUNTIES)]}</td>'
+            f'<td>Resurfacing and bridge repair, section {i}</td>'
+            f'<td>{STATUSES[i % len(STATUSES)]}</td></tr>'
+        )
+    parts.append('</table></body></html>')
+    return ''.join(parts)
+
+
+def list_based_parse(html_content, base_url):
+    """The original parse_repository_page implementation"""
+    parser = scrape.SimpleHTMLParser()
+    parser.feed(html_content)
+
+    # The old parser kept one page-wide list of links
+    links = [link for table in parser.tables for row in table for link in row.links]
+    contract_urls = []
+    for link in links:
+        if 'LbContractDetail' in link:
+            full_url = urljoin(base_url, link)
+            if full_url not in contract_urls:
+                contract_urls.append(full_url)
+
+    filtered_urls = []
+    for table in parser.tables:
+        for row in table:
+            if len(row) < 3:
+                continue
+            row_text = ' '.join(row).lower()
+            has_valid_county = any(county in row_text for county in scrape.VALID_COUNTIES)
+            has_valid_status = any(status in row_text for status in scrape.VALID_STATUSES)
+            if has_valid_county and has_valid_status:
+                if contract_urls:
+                    url = contract_urls.pop(0)
+                    if url not in filtered_urls:
+                        filtered_urls.append(url)
+    return filtered_urls
+
+
+def best_of(func, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def html_parse_only(html_content):
+    scrape.SimpleHTMLParser().feed(html_content)
+
+
+def main():
+    print(f"{'rows':>7} {'html parse (s)':>15} {'list-based (s)':>15} {'current (s)':>12} {'speedup':>8}")
+    for rows in (1250, 2500, 5000, 10000):
+        page = synthetic_letting(rows)
+        assert len(list_based_parse(page, BASE_URL)) == len(scrape.parse_repository_page(page, BASE_URL))
+        parse_time = best_of(html_parse_only, page)
+        old = best_of(list_based_parse, page, BASE_URL)
+        new = best_of(scrape.parse_repository_page, page, BASE_URL)
+        print(f'{rows:>7} {parse_time:15.4f} {old:15.4f} {new:12.4f} {old / new:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Tests for api/scrape.py: continuation tokens, the contract store and
+response body decoding. They need no network access.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import scrape  # noqa: E402
+
+REPO_URL = 'https://webapps1.dot.illinois.gov/WCTB/LbLettingDetail/1'
+
+
+def repository_row(number, status='Awarded'):
+    """A parse_repository_rows dict for contract number"""
+    url = f'https://webapps1.dot.illinois.gov/WCTB/LbContractDetail/{number}'
+    return {
+        'contract_url': url,
+        'contract_number': str(number),
+        'county': 'Cook',
+        'status': status,
+        'cells': [str(number), 'Cook', status]
+    }
+
+
+def csv_row(number, low_bidder='Low Bidder LLC'):
+    """A scrape_contract row for contract number"""
+    return {
+        'contract_url': f'https://webapps1.dot.illinois.gov/WCTB/LbContractDetail/{number}',
+        'low_bidder': low_bidder,
+        'low_bid_amount': '$1,000.00',
+        'awardee': low_bidder
+    }
+
+
+def pack_token(state):
+    """Encode a token state the way make_continuation_token does"""
+    return base64.urlsafe_b64encode(zlib.compress(json.dumps(state).encode('utf-8'))).decode('ascii')
+
+
+class ContinuationTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = [repository_row(n) for n in range(20)]
+        self.urls = [row['contract_url'] for row in self.rows]
+
+    def test_round_trip(self):
+        remaining = [self.urls[1], self.urls[9], self.urls[19]]
+        token = scrape.make_continuation_token(REPO_URL, self.urls, remaining, 1700000000.5)
+        repo_url, listing, count, mask, started = scrape.read_continuation_token(token)
+        self.assertEqual(repo_url, REPO_URL)
+        self.assertEqual(count, 20)
+        self.assertEqual(started, 1700000000)
+        contract_urls, todo_urls = scrape.resume_contract_urls(self.rows, listing, count, mask)
+        self.assertEqual(contract_urls, self.urls)
+        self.assertEqual(todo_urls, remaining)
+
+    def test_rejects_garbage(self):
+        for token in ('', '!!!', base64.urlsafe_b64encode(b'not zlib').decode('ascii'), pack_token([1, 2])):
+            with self.assertRaises(scrape.ContinuationError):
+                scrape.read_continuation_token(token)
+
+    def test_rejects_other_versions(self):
+        with self.assertRaisesRegex(scrape.ContinuationError, 'version'):
+            scrape.read_continuation_token(pack_token({'v': 1, 'repo_url': REPO_URL, 'remaining': []}))
+
+    def test_rejects_bad_counts(self):
+        base = {'v': 2, 'repo_url': REPO_URL, 'listing': 'x', 'started': 0}
+        for count, remaining in ((24, 'ff'), (-1, ''), ('8', 'ff'), (True, 'ff'),
+                                 (scrape.MAX_CONTINUATION_CONTRACTS + 8, 'ff' * 12501)):
+            with self.assertRaises(scrape.ContinuationError):
+                scrape.read_continuation_token(pack_token({**base, 'count': count, 'remaining': remaining}))
+
+    def test_rejects_oversized_tokens(self):
+        state = {'v': 2, 'repo_url': 'x' * (scrape.MAX_CONTINUATION_TOKEN_BYTES * 4), 'listing': 'x',
+                 'count': 0, 'remaining': '', 'started': 0}
+        with self.assertRaises(scrape.ContinuationError):
+            scrape.read_continuation_token(pack_token(state))
+
+    def test_rejects_changed_listing(self):
+        token = scrape.make_continuation_token(REPO_URL, self.urls, self.urls[5:], 0)
+        _, listing, count, mask, _ = scrape.read_continuation_token(token)
+        with self.assertRaises(scrape.ContinuationError):
+            scrape.resume_contract_urls(self.rows[:-1], listing, count, mask)
+        with self.assertRaises(scrape.ContinuationError):
+            scrape.resume_contract_urls(self.rows[1:] + self.rows[:1], listing, count, mask)
+
+
+class ContractStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = scrape.ContractStore(os.path.join(self.directory, 'store.sqlite3'))
+
+    def tearDown(self):
+        if self.store.db is not None:
+            self.store.db.close()
+        shutil.rmtree(self.directory)
+
+    def test_unchanged_rows_are_reused(self):
+        rows = [repository_row(1), repository_row(2)]
+        self.store.save_listing(REPO_URL, rows)
+        self.store.save_row(csv_row(1))
+        self.assertEqual(self.store.unchanged_rows(rows), {rows[0]['contract_url']: csv_row(1)})
+
+    def test_status_change_needs_a_refetch(self):
+        self.store.save_listing(REPO_URL, [repository_row(1, 'Let')])
+        self.store.save_row(csv_row(1))
+        relisted = [repository_row(1, 'Awarded')]
+        self.store.save_listing(REPO_URL, relisted)
+        self.assertEqual(self.store.unchanged_rows(relisted), {})
+        # Scraped again under the new row, it is reusable again
+        self.store.save_row(csv_row(1, 'New Awardee Inc'))
+        self.assertEqual(self.store.unchanged_rows(relisted)[relisted[0]['contract_url']]['low_bidder'],
+                         'New Awardee Inc')
+
+    def test_fetched_since(self):
+        rows = [repository_row(1)]
+        self.store.save_listing(REPO_URL, rows)
+        with mock.patch.object(scrape.time, 'time', return_value=1000.0):
+            self.store.save_row(csv_row(1))
+        self.assertEqual(self.store.unchanged_rows(rows, fetched_since=2000), {})
+        self.assertEqual(len(self.store.unchanged_rows(rows, fetched_since=1000)), 1)
+
+    def test_upsert_keeps_changed_at_for_same_fields(self):
+        self.store.save_listing(REPO_URL, [repository_row(1)])
+        with mock.patch.object(scrape.time, 'time', return_value=1000.0):
+            self.store.save_row(csv_row(1))
+        with mock.patch.object(scrape.time, 'time', return_value=2000.0):
+            self.store.save_row(csv_row(1))
+        [stored] = self.store.query(REPO_URL)
+        self.assertEqual((stored['fetched_at'], stored['changed_at']), (2000.0, 1000.0))
+        with mock.patch.object(scrape.time, 'time', return_value=3000.0):
+            self.store.save_row(csv_row(1, 'Someone Else'))
+        [stored] = self.store.query(REPO_URL)
+        self.assertEqual((stored['changed_at'], stored['low_bidder']), (3000.0, 'Someone Else'))
+
+    def test_error_rows_are_not_stored(self):
+        rows = [repository_row(1)]
+        self.store.save_listing(REPO_URL, rows)
+        self.store.save_row(csv_row(1, 'ERROR: Failed to fetch'))
+        self.assertEqual(self.store.unchanged_rows(rows), {})
+        self.assertEqual(self.store.query(REPO_URL), [])
+
+    def test_incremental_scrape_fetches_only_changed_contracts(self):
+        listings = [[repository_row(1), repository_row(2)], [repository_row(1), repository_row(2, 'Let')]]
+        fetched = []
+
+        async def fetch_rows(repo_url, deadline=None, max_age=0):
+            rows = listings.pop(0)
+            self.store.save_listing(repo_url, rows)
+            return rows
+
+        def scrape_contract(contract_url, deadline=None, max_age=scrape.CACHE_FRESH_SECONDS):
+            fetched.append(contract_url)
+            return {**csv_row(0), 'contract_url': contract_url}
+
+        with mock.patch.object(scrape, 'CONTRACT_STORE', self.store), \
+                mock.patch.object(scrape, 'fetch_repository_rows_async', fetch_rows), \
+                mock.patch.object(scrape, 'scrape_contract', scrape_contract):
+            first = scrape.process_repository(REPO_URL)
+            second = scrape.process_repository(REPO_URL)
+        self.assertEqual((first['contracts'], first['reused']), (2, 0))
+        self.assertEqual((second['contracts'], second['reused']), (2, 1))
+        self.assertEqual(fetched[2:], [repository_row(2)['contract_url']])
+
+
+class ContentDecoderTest(unittest.TestCase):
+    BODY = b'<html><body>' + b'<tr><td>Contract</td></tr>' * 2000 + b'</body></html>'
+
+    def compress(self, wbits):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+        return compressor.compress(self.BODY) + compressor.flush()
+
+    def decode(self, encoding, data, chunk_size=100, max_length=0):
+        decoder = scrape.ContentDecoder(encoding)
+        decoded = []
+        for start in range(0, len(data), chunk_size):
+            decoded.append(decoder.decompress(data[start:start + chunk_size], max_length))
+            while decoder.has_pending():
+                decoded.append(decoder.decompress(b'', max_length))
+        decoded.append(decoder.flush())
+        return b''.join(decoded)
+
+    def test_gzip(self):
+        self.assertEqual(self.decode('gzip', self.compress(16 + zlib.MAX_WBITS)), self.BODY)
+
+    def test_zlib_deflate(self):
+        self.assertEqual(self.decode('deflate', self.compress(zlib.MAX_WBITS)), self.BODY)
+
+    def test_raw_deflate(self):
+        self.assertEqual(self.decode('deflate', self.compress(-zlib.MAX_WBITS)), self.BODY)
+
+    def test_max_length_holds_output_back(self):
+        self.assertEqual(self.decode('gzip', self.compress(16 + zlib.MAX_WBITS), 1000, max_length=512), self.BODY)
+
+    def test_identity_and_unknown(self):
+        self.assertEqual(self.decode(None, self.BODY), self.BODY)
+        with self.assertRaises(scrape.FetchError):
+            scrape.ContentDecoder('compress')
+
+
+if __name__ == '__main__':
+    unittest.main()